@@ -3,47 +3,260 @@
 Created on Fri Jun 10 17:28:34 2022
 
 @author: natha
+
+Client for the Host API. HostClient keeps one pooled keep-alive session
+with retries; AsyncHostClient fans calls out over that session from
+asyncio with a cap on how many run at once.
+
+Streamed endpoints are read row by row with iter_ndjson():
+
+    with HostClient() as client:
+        for row in client.iter_ndjson('/youngs/sweep', material='800H',
+                                      start=20, stop=1000, step=1):
+            print(row['temperature'], row['Result'])
 """
 
-import requests
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import io
 import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from jsonpipe import convert, drop, iter_array, pipeline, write_array
+
+BASE_URL = "http://localhost:5000"
+
+# Matches the host's MAX_BULK / MAX_BATCH, so big requests get split
+DRINKS_PER_BATCH = 10000
+POINTS_PER_BATCH = 100000
+# Bodies kept for If-None-Match revalidation, least recently used dropped
+ETAG_CACHE_SIZE = 256
+
+
+class HostClient:
+    def __init__(self, base_url=BASE_URL, pool_size=10, retries=3,
+                 backoff=0.3, timeout=10, etag_cache_size=ETAG_CACHE_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.etag_cache_size = etag_cache_size
+
+        # Retries connection errors and overloaded replies, waiting
+        # backoff * 2**n between attempts
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # url -> (ETag, raw body) from the last 200 response
+        self._etags = OrderedDict()
+        self._etags_lock = threading.Lock()
+        # Batch endpoints the server turned out not to have
+        self._unsupported = set()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _url(self, path):
+        return self.base_url + path
+
+    def get_json(self, path, **params):
+        # Revalidates with If-None-Match so an unchanged resource costs a 304
+        url = requests.Request('GET', self._url(path), params=params).prepare().url
+        with self._etags_lock:
+            cached = self._etags.get(url)
+            if cached is not None:
+                self._etags.move_to_end(url)
+        headers = {} if cached is None else {'If-None-Match': cached[0]}
+        res = self.session.get(url, headers=headers, timeout=self.timeout)
+        if res.status_code == 304 and cached is not None:
+            # Decoded afresh each time, so callers never share one object
+            return json.loads(cached[1])
+        res.raise_for_status()
+        data = res.json()
+        if 'ETag' in res.headers:
+            with self._etags_lock:
+                self._etags[url] = (res.headers['ETag'], res.content)
+                self._etags.move_to_end(url)
+                while len(self._etags) > self.etag_cache_size:
+                    self._etags.popitem(last=False)
+        return data
+
+    def iter_ndjson(self, path, **params):
+        # Yields one row at a time from an NDJSON endpoint without buffering
+        # the whole response
+        with self.session.get(self._url(path), params=params, stream=True,
+                              timeout=self.timeout,
+                              headers={'Accept': 'application/x-ndjson'}) as res:
+            res.raise_for_status()
+            for line in res.iter_lines(chunk_size=65536):
+                if line:
+                    yield json.loads(line)
+
+    def _batch(self, method, path, **kwargs):
+        """Call a batch endpoint, or return None if the server lacks it."""
+        if path in self._unsupported:
+            return None
+        res = self.session.request(method, self._url(path), timeout=self.timeout, **kwargs)
+        # A missing route gets Flask's HTML error page; the endpoint's own
+        # {"error": ...} replies (e.g. an unknown material) are real errors
+        if res.status_code in (404, 405) and not self._is_api_error(res):
+            self._unsupported.add(path)
+            return None
+        res.raise_for_status()
+        return res
+
+    @staticmethod
+    def _is_api_error(res):
+        try:
+            return 'error' in res.json()
+        except ValueError:
+            return False
+
+    def _fan_out(self, fn, items):
+        with ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+            return list(pool.map(fn, items))
+
+    def get_drink(self, id):
+        return self.get_json(f'/drinks/{id}')
+
+    def get_drinks(self, after=0, limit=100):
+        return self.get_json('/drinks', after=after, limit=limit)
+
+    def iter_drinks(self, after=0):
+        return self.iter_ndjson('/drinks', after=after)
+
+    def get_drinks_many(self, ids):
+        """Drinks for `ids`, in that order; ids with no drink are skipped."""
+        ids = list(ids)
+        found = {}
+        for lo in range(0, len(ids), DRINKS_PER_BATCH):
+            chunk = ids[lo:lo + DRINKS_PER_BATCH]
+            res = self._batch('GET', '/drinks/bulk',
+                              params={'ids': ','.join(map(str, chunk))})
+            if res is None:
+                break
+            found.update((d['id'], d) for d in res.json()['drinks'])
+        else:
+            return [found[i] for i in ids if i in found]
+
+        # No batch endpoint, so one request per drink, several at a time
+        def fetch(id):
+            try:
+                return dict(self.get_drink(id), id=id)
+            except requests.HTTPError as e:
+                if e.response.status_code == 404:
+                    return None
+                raise
+        return [d for d in self._fan_out(fetch, ids) if d is not None]
+
+    def add_drinks(self, drinks):
+        res = self.session.post(self._url('/drinks/bulk'), json={'drinks': list(drinks)},
+                                timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()['ids']
+
+    def delete_drinks(self, ids):
+        res = self.session.delete(self._url('/drinks/bulk'), json={'ids': list(ids)},
+                                  timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()['deleted']
+
+    def youngs(self, material='800H', temperature=500):
+        return self.get_json('/youngs/', material=material, temperature=temperature)['Result']
+
+    def youngs_sweep(self, material, temps):
+        """Young's modulus of `material` at each of `temps`."""
+        temps = list(temps)
+        out = []
+        for lo in range(0, len(temps), POINTS_PER_BATCH):
+            pairs = [[material, t] for t in temps[lo:lo + POINTS_PER_BATCH]]
+            res = self._batch('POST', '/youngs/batch', json={'pairs': pairs})
+            if res is None:
+                break
+            out.extend(res.json()['Result'])
+        else:
+            return out
+
+        return self._fan_out(lambda t: self.youngs(material, t), temps)
+
+
+class AsyncHostClient:
+    """asyncio front end running at most `concurrency` calls at once."""
+
+    def __init__(self, client=None, concurrency=8):
+        self.client = client if client is not None else HostClient(pool_size=concurrency)
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def call(self, fn, *args, **kwargs):
+        # The pooled session is blocking, so each call gets a worker thread
+        async with self._slots:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def gather(self, fn, items):
+        return await asyncio.gather(*(self.call(fn, item) for item in items))
+
+    async def get_drink(self, id):
+        return await self.call(self.client.get_drink, id)
+
+    async def get_drinks_many(self, ids):
+        return await self.call(self.client.get_drinks_many, ids)
+
+    async def youngs(self, material='800H', temperature=500):
+        return await self.call(self.client.youngs, material, temperature)
+
+    async def youngs_sweep(self, material, temps):
+        return await self.call(self.client.youngs_sweep, material, temps)
+
+    def close(self):
+        self.client.close()
+
+
+if __name__ == "__main__":
+    people_string = '''
+    {
+     "people": [
+         {
+          "name": "Nathaniel Thomas",
+          "phone": "512-952-1017",
+          "emails": ["nathaniel@swbell.net", "nathanielt124@gmail.com"],
+          "has_license": false
+          },
+         {
+          "name": "John Mane",
+          "phone": "512-327-1182",
+          "emails": ["john@hotmail.com", "jmane@gmail.com"],
+          "has_license": true
+          }
+         ]
+     }
+    '''
+
+    people = pipeline(iter_array(io.StringIO(people_string), 'people'), drop('phone'))
+    out = io.StringIO()
+    write_array(people, out, key='people', indent=2, sort_keys=True)
+    new_string = out.getvalue()
+
+    # print(new_string)
+
+    # Streams record by record, so this works the same on a huge export
+    convert('states.json', 'new_states.json', key='states', indent=2, sort_keys=True)
 
-people_string = '''
-{
- "people": [
-     {
-      "name": "Nathaniel Thomas",
-      "phone": "512-952-1017",
-      "emails": ["nathaniel@swbell.net", "nathanielt124@gmail.com"],
-      "has_license": false
-      },
-     {
-      "name": "John Mane",
-      "phone": "512-327-1182",
-      "emails": ["john@hotmail.com", "jmane@gmail.com"],
-      "has_license": true
-      }
-     ]
- }
-'''
-
-data = json.loads(people_string)
-
-for person in data['people']:
-    del person['phone']
-
-new_string = json.dumps(data, indent=2, sort_keys=True)
-
-# print(new_string)
-
-with open('states.json') as f:
-    data = json.load(f)
-    
-with open('new_states.json', 'w') as f:
-    json.dump(data, f, indent=2, sort_keys=True)
-    
-res = requests.get("http://localhost:5000/drinks/1")
-data = res.json()
-
-print(data['name'])
+    with HostClient() as client:
+        data = client.get_drink(1)
 
+        print(data['name'])
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming transforms over JSON arrays of records.
+
+iter_array() reads the elements of an array (the whole document, or the
+array under one top-level key such as "states") one at a time from a file,
+stages like drop() and project() change records as they pass, and
+write_array() writes them back out through a buffered file. Nothing holds
+more than one record plus a read chunk in memory.
+
+    python jsonpipe.py states states.json new_states.json
+    python jsonpipe.py people people.json new_people.json
+    python jsonpipe.py transform in.json out.json --key people --drop phone
+
+Output matches json.dump() byte for byte. Passing fast=True (--fast)
+encodes with orjson when it is installed; that is valid, equivalent JSON
+but not byte-identical (non-ASCII is written as UTF-8, exponents and
+compact separators differ).
+
+With a key, only the array under that key is carried through; any other
+top-level keys of the input are not written out.
+"""
+import argparse
+import json
+import re
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 1 << 16
+WRITE_BUFFER = 1 << 20
+WHITESPACE = ' \t\n\r'
+# Whatever follows a decoded number, if it could still be part of that number
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Pulls JSON values off a file, reading more only when it needs to."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed so the buffer stays about chunk-sized
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, or '' at the end of the file."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at offset {self.pos}, "
+                             f"found {self.peek() or 'end of file'!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value runs past the buffer; if not, the
+                # error is real and comes back once the file is exhausted
+                if self._fill():
+                    continue
+                raise
+            # A number running into the end of the buffer may have been cut
+            # short ("2." decodes as 2), so read on before trusting it
+            if (type(value) in (int, float) and not self.eof
+                    and NUMBER_TAIL.match(self.buf, end)):
+                if self._fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_array(f, key=None, chunk_size=CHUNK_SIZE):
+    """Yield the elements of a JSON array read incrementally from `f`.
+
+    With `key`, the document must be an object and the array is the value
+    under that top-level key; otherwise the document itself is the array.
+    Other top-level keys are skipped over, not returned.
+    """
+    reader = _Reader(f, chunk_size)
+    if key is not None:
+        reader.expect('{')
+        while True:
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                break
+            reader.value()
+            if reader.peek() != ',':
+                raise KeyError(key)
+            reader.pos += 1
+
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() == ',':
+            reader.pos += 1
+            continue
+        reader.expect(']')
+        return
+
+
+def drop(*fields):
+    """Stage removing `fields` from every record that has them."""
+    def stage(records):
+        for record in records:
+            for field in fields:
+                record.pop(field, None)
+            yield record
+    return stage
+
+
+def project(*fields):
+    """Stage keeping only `fields` of every record."""
+    def stage(records):
+        for record in records:
+            yield {field: record[field] for field in fields if field in record}
+    return stage
+
+
+def pipeline(records, *stages):
+    for stage in stages:
+        records = stage(records)
+    return records
+
+
+def _encoder(indent, sort_keys, fast=False):
+    if fast and orjson is not None and indent in (None, 2):
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        return lambda record: orjson.dumps(record, option=option).decode()
+    return json.JSONEncoder(indent=indent, sort_keys=sort_keys).encode
+
+
+def write_array(records, f, key=None, indent=None, sort_keys=False, fast=False):
+    """Write `records` as a JSON array, under `key` if given, to `f`.
+
+    Lays the document out exactly as json.dump() with the same indent
+    would, unless `fast` hands encoding to orjson. Returns the number of
+    records written.
+    """
+    encode = _encoder(indent, sort_keys, fast)
+    write = f.write
+    depth = 0 if key is None else 1
+
+    if indent is None:
+        sep, close = ', ', ']'
+        first = ''
+        write('[' if key is None else '{' + json.dumps(key) + ': [')
+    else:
+        pad = '\n' + ' ' * (indent * (depth + 1))
+        sep, first = ',' + pad, pad
+        close = '\n' + ' ' * (indent * depth) + ']'
+        if key is None:
+            write('[')
+        else:
+            write('{\n' + ' ' * indent + json.dumps(key) + ': [')
+
+    count = 0
+    for record in records:
+        text = encode(record)
+        if indent is not None:
+            text = text.replace('\n', pad)
+        write((first if count == 0 else sep) + text)
+        count += 1
+
+    write(close if count else ']')
+    if key is not None:
+        write('}' if indent is None else '\n}')
+    return count
+
+
+def convert(src, dst, key=None, stages=(), indent=None, sort_keys=False, fast=False):
+    """Stream the array in `src` through `stages` into `dst`.
+
+    With `key`, `dst` holds only {key: [...]}; other top-level keys of
+    `src` are dropped.
+    """
+    with open(src, encoding='utf-8') as fin, \
+         open(dst, 'w', encoding='utf-8', buffering=WRITE_BUFFER) as fout:
+        records = pipeline(iter_array(fin, key), *stages)
+        return write_array(records, fout, key=key, indent=indent,
+                           sort_keys=sort_keys, fast=fast)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream-transform JSON record arrays.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    states = commands.add_parser('states', help='reformat states.json (sorted keys, indent 2)')
+    people = commands.add_parser('people', help='strip phone numbers from a people document')
+    generic = commands.add_parser('transform', help='any array, any stages')
+    for sub in (states, people, generic):
+        sub.add_argument('src')
+        sub.add_argument('dst')
+        sub.add_argument('--fast', action='store_true',
+                         help='encode with orjson if installed (not byte-identical to json)')
+    generic.add_argument('--key', help='top-level key holding the array; '
+                                       'other top-level keys are not copied')
+    generic.add_argument('--drop', nargs='+', default=[], metavar='FIELD')
+    generic.add_argument('--fields', nargs='+', metavar='FIELD', help='keep only these')
+    generic.add_argument('--indent', type=int)
+    generic.add_argument('--sort-keys', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'states':
+        n = convert(args.src, args.dst, key='states', indent=2, sort_keys=True,
+                    fast=args.fast)
+    elif args.command == 'people':
+        n = convert(args.src, args.dst, key='people', stages=[drop('phone')],
+                    indent=2, sort_keys=True, fast=args.fast)
+    else:
+        stages = []
+        if args.drop:
+            stages.append(drop(*args.drop))
+        if args.fields:
+            stages.append(project(*args.fields))
+        n = convert(args.src, args.dst, key=args.key, stages=stages,
+                    indent=args.indent, sort_keys=args.sort_keys, fast=args.fast)
+    print(f'{n} records written to {args.dst}', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,68 @@ import 'dart:convert';
 import 'package:flutter/material.dart';
 import 'package:http/http.dart' as http;
 
+// Last ETag and body seen for each URL, so repeat fetches can be
+// answered with a 304 instead of the full payload.
+final Map<Uri, String> _etags = {};
+final Map<Uri, String> _bodies = {};
+
 Future<Album> fetchAlbum() async {
-  final response = await http.get(Uri.parse('http://localhost:5000/youngs/'));
+  final uri = Uri.parse('http://localhost:5000/youngs/');
+  final etag = _etags[uri];
+  final response = await http.get(uri,
+      headers: etag == null ? null : {'If-None-Match': etag});
 
-  if (response.statusCode == 200) {
+  if (response.statusCode == 304 && _bodies.containsKey(uri)) {
+    // Unchanged since last time, reuse what we already have
+    return Album.fromJson(jsonDecode(_bodies[uri]!));
+  } else if (response.statusCode == 200) {
     // All good from the server, parse the JSON
+    final newEtag = response.headers['etag'];
+    if (newEtag != null) {
+      _etags[uri] = newEtag;
+      _bodies[uri] = response.body;
+    }
     return Album.fromJson(jsonDecode(response.body));
   } else {
     throw Exception('Failed to retrieve drink');
   }
 }
 
+// Reads an NDJSON endpoint line by line, yielding each row as soon as it
+// arrives instead of waiting for the whole body.
+Stream<Map<String, dynamic>> fetchRows(Uri uri) async* {
+  final client = http.Client();
+  try {
+    final request = http.Request('GET', uri)
+      ..headers['Accept'] = 'application/x-ndjson';
+    final response = await client.send(request);
+
+    if (response.statusCode != 200) {
+      throw Exception('Failed to retrieve rows');
+    }
+
+    final lines =
+        response.stream.transform(utf8.decoder).transform(const LineSplitter());
+    await for (final line in lines) {
+      if (line.isNotEmpty) {
+        yield jsonDecode(line) as Map<String, dynamic>;
+      }
+    }
+  } finally {
+    client.close();
+  }
+}
+
+Stream<Map<String, dynamic>> fetchYoungsSweep(
+    String material, double start, double stop, double step) {
+  return fetchRows(Uri.http('localhost:5000', '/youngs/sweep', {
+    'material': material,
+    'start': '$start',
+    'stop': '$stop',
+    'step': '$step',
+  }));
+}
+
 class Album {
   final String name;
   final String description;
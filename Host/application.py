@@ -4,15 +4,80 @@ Created on Fri Jun 10 17:55:37 2022
 
 @author: natha
 """
-from flask import Flask, request
-import HBBdata
-# from flask_sqlalchemy import SQLAlchemy
+import math
+import os
+import sqlite3
+
+from flask import Flask, request, Response
+from flask_sqlalchemy import SQLAlchemy
+import numpy as np
+from sqlalchemy import delete, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from cache import ResponseCache
+from instrumentation import Instrumentation, span
+from properties import PropertyEngine
+from streaming import ndjson_response, wants_ndjson
 
 app = Flask(__name__)
 
-# app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db'
-# db  = SQLAlchemy(app)
-"""
+# Material tables come from the prebuilt index (see build_index.py) when
+# there is one, so workers share its pages; otherwise they are sampled once
+# here rather than on every request
+PROPERTY_INDEX = os.environ.get('PROPERTY_INDEX', os.path.join(app.root_path, 'properties.idx'))
+# Tabulated at startup; others are tabulated on their first lookup
+PROPERTY_MATERIALS = os.environ.get('PROPERTY_MATERIALS', '800H').split(',')
+if os.path.exists(PROPERTY_INDEX):
+    engine = PropertyEngine.from_index(PROPERTY_INDEX)
+else:
+    engine = PropertyEngine(materials=PROPERTY_MATERIALS)
+# In-process by default; set RESPONSE_CACHE_PATH to share one across workers
+cache = ResponseCache()
+
+# Per-phase timings, /metrics, and profiling when HOST_PROFILING is set
+instrumentation = Instrumentation(app)
+instrumentation.add_cache('property_cache', engine.stats)
+instrumentation.add_cache('response_cache', cache.stats)
+
+# Upper bound on points computed by a single batch request
+MAX_BATCH = 100000
+# Streamed sweeps are computed STREAM_CHUNK points at a time, so they can
+# be far larger than a batch
+MAX_STREAM = 10000000
+STREAM_CHUNK = 4096
+
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DRINKS_DATABASE_URI', 'sqlite:///' + os.path.join(app.root_path, 'data.db'))
+# Keep connections open between requests instead of reconnecting each time
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+}
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Pooled connections move between threads, and writers wait on locks
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {
+        'check_same_thread': False, 'timeout': 30}
+db = SQLAlchemy(app)
+
+# Largest page a client may ask for, and the most rows per bulk request
+MAX_PAGE = 1000
+MAX_BULK = 10000
+# SQLite caps bound parameters per statement, so id lists go in slices
+ID_CHUNK = 500
+# Ids are 64-bit; anything wider can't even be bound as a parameter
+MIN_ID, MAX_ID = -2 ** 63, 2 ** 63 - 1
+
+@event.listens_for(Engine, 'connect')
+def sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a write is in progress
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
 class Drink(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80),unique=True, nullable=False)
@@ -20,60 +85,288 @@ class Drink(db.Model):
 
     def __repr__(self):
         return f"{self.name} - {self.description}"
-"""
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "description": self.description}
+
+with app.app_context():
+    db.create_all()
 
 @app.route('/home')
+@cache.cached()
 def home():
     return "Hello, this is the main page <h1>HELLO<h1>"
 
 @app.route('/')
+@cache.cached()
 def index():
     return 'Hello!'
 
-"""
+def iter_drinks(after=0, chunk=MAX_PAGE):
+    # Walks the table in id order one keyset page at a time
+    while True:
+        page = (Drink.query.filter(Drink.id > after)
+                .order_by(Drink.id).limit(chunk).all())
+        for drink in page:
+            yield drink.to_dict()
+        if len(page) < chunk:
+            return
+        after = page[-1].id
+
+def check_ids(ids):
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError("ids must be integers")
+    if not all(MIN_ID <= i <= MAX_ID for i in ids):
+        raise ValueError(f"ids must be between {MIN_ID} and {MAX_ID}")
+    return ids
+
 @app.route('/drinks')
+@cache.cached(tags=lambda: ('drinks',), unless=wants_ndjson)
 def get_drinks():
-    drinks = Drink.query.all()
+    after = request.args.get('after', 0, type=int)
+    try:
+        check_ids([after])
+    except ValueError as e:
+        return {"error": f"bad after: {e}"}, 400
+    if wants_ndjson():
+        return ndjson_response(iter_drinks(after))
 
-    output = []
-    for drink in drinks:
-        drink_data = {'name': drink.name, 'description': drink. description}
-        output.append(drink_data)
-    return {"drinks": output}
-"""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PAGE)
+    drinks = (Drink.query.filter(Drink.id > after)
+              .order_by(Drink.id).limit(limit).all())
+    output = [drink.to_dict() for drink in drinks]
+    # Pass "next" back as ?after= to get the following page
+    next_after = drinks[-1].id if len(drinks) == limit else None
+    return {"drinks": output, "next": next_after}
 
-"""
-@app.route('/drinks/<id>')
+@app.route('/drinks/<int:id>')
+@cache.cached(tags=lambda id: (f'drink:{id}',))
 def get_drink(id):
-    drink = Drink.query.get_or_404(id)
+    # Too big to be stored, so there's no such drink
+    if id > MAX_ID:
+        return {"error": "not found"}, 404
+    drink = db.get_or_404(Drink, id)
     return {"name": drink.name, "description": drink.description}
-"""
 
-"""
+@app.route('/drinks/bulk')
+@cache.cached(tags=lambda: ('drinks',))
+def get_drinks_bulk():
+    # ?ids=1,2,3; ids that don't exist are left out of the reply
+    try:
+        ids = check_ids([int(i) for i in request.args.get('ids', '').split(',') if i])
+    except ValueError:
+        return {"error": "ids must be a comma-separated list of 64-bit integers"}, 400
+    if len(ids) > MAX_BULK:
+        return {"error": f"{len(ids)} ids given, limit is {MAX_BULK}"}, 400
+    output = []
+    for lo in range(0, len(ids), ID_CHUNK):
+        drinks = Drink.query.filter(Drink.id.in_(ids[lo:lo + ID_CHUNK])).all()
+        output.extend(drink.to_dict() for drink in drinks)
+    return {"drinks": output}
+
+def json_list(field):
+    # The list under `field` of a JSON object body, or ValueError
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get(field, []), list):
+        raise ValueError(f'expected a JSON object with a "{field}" list')
+    return body.get(field, [])
+
+def drink_from_json(row):
+    if not isinstance(row, dict) or not isinstance(row.get('name'), str):
+        raise ValueError(f"drinks need a string name, got {row!r}")
+    description = row.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError(f"description must be a string, got {description!r}")
+    return Drink(name=row['name'], description=description)
+
 @app.route('/drinks', methods=['POST'])
 def add_drink():
-    drink = Drink(name=request.json['name'], description=request.json['description'])
+    try:
+        drink = drink_from_json(request.get_json(silent=True))
+    except ValueError as e:
+        return {"error": str(e)}, 400
     db.session.add(drink)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return {"error": f"drink {drink.name!r} already exists"}, 409
+    cache.invalidate('drinks')
     return {'id': drink.id}
-"""
 
-"""
-@app.route('/drinks/<id>', methods=['DELETE'])
-def delete_drink():
-    drink = Drink.query.get(id)
+@app.route('/drinks/bulk', methods=['POST'])
+def add_drinks():
+    try:
+        rows = json_list('drinks')
+        if len(rows) > MAX_BULK:
+            raise ValueError(f"{len(rows)} drinks given, limit is {MAX_BULK}")
+        drinks = [drink_from_json(row) for row in rows]
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    db.session.add_all(drinks)
+    # One commit for the whole batch; a duplicate name rejects all of it
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return {"error": f"batch rejected: {e.orig}"}, 409
+    cache.invalidate('drinks')
+    return {'ids': [drink.id for drink in drinks]}
+
+@app.route('/drinks/<int:id>', methods=['DELETE'])
+def delete_drink(id):
+    drink = db.session.get(Drink, id) if id <= MAX_ID else None
     if drink is None:
-        return {"error": "not found"}
+        return {"error": "not found"}, 404
     db.session.delete(drink)
     db.session.commit()
+    cache.invalidate('drinks', f'drink:{id}')
     return {"message:": "That drink was yote"}
-"""
+
+@app.route('/drinks/bulk', methods=['DELETE'])
+def delete_drinks():
+    try:
+        ids = json_list('ids')
+        if len(ids) > MAX_BULK:
+            raise ValueError(f"{len(ids)} ids given, limit is {MAX_BULK}")
+        check_ids(ids)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    deleted = 0
+    for lo in range(0, len(ids), ID_CHUNK):
+        res = db.session.execute(
+            delete(Drink).where(Drink.id.in_(ids[lo:lo + ID_CHUNK])))
+        deleted += res.rowcount
+    db.session.commit()
+    cache.invalidate('drinks', *(f'drink:{i}' for i in ids))
+    return {"deleted": deleted}
+
+def finite_float(value, name):
+    # float() alone lets "nan" and "inf" through, which can't go out as JSON
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be finite, got {value!r}")
+    return value
 
 @app.route('/youngs/')
+@cache.cached()
 def youngs():
     # return {"name": "Cranberry Applesauce", "description": "It's more like a snack than a drink."}
-    res = HBBdata.elastic.youngs('800H', 500);
-    return {"Result": res[0]}
+    material = request.args.get('material', '800H')
+    try:
+        temperature = finite_float(request.args.get('temperature', 500.0), 'temperature')
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    try:
+        with span('lookup'):
+            res = engine.lookup(material, temperature)
+    except LookupError as e:
+        return {"error": str(e)}, 404
+    return {"Result": res}
+
+def sweep_count(start, stop, step, limit=MAX_BATCH):
+    start = finite_float(start, 'start')
+    stop = finite_float(stop, 'stop')
+    step = finite_float(step, 'step')
+    if step <= 0:
+        raise ValueError("step must be positive")
+    # Inclusive of stop, without float drift pushing us one point past it;
+    # a tiny step can still overflow the division
+    span_steps = (stop - start) / step
+    if not math.isfinite(span_steps):
+        raise ValueError(f"sweep from {start} to {stop} by {step} is too long")
+    count = int(np.floor(span_steps + 1e-9)) + 1
+    if count <= 0:
+        raise ValueError("stop must not be below start")
+    if count > limit:
+        raise ValueError(f"sweep has {count} points, limit is {limit}")
+    return count
+
+def sweep_temperatures(start, stop, step):
+    count = sweep_count(start, stop, step)
+    return float(start) + float(step) * np.arange(count)
+
+def parse_batch():
+    """Read a batch query as (materials, temperatures) from JSON or args.
+
+    Accepts either {"pairs": [[material, temperature], ...]} or a sweep
+    given as material/start/stop/step, in which case the material comes
+    back as a single name rather than a column.
+    """
+    params = request.get_json(silent=True) or request.args
+    if 'pairs' in params:
+        pairs = params['pairs']
+        if len(pairs) > MAX_BATCH:
+            raise ValueError(f"{len(pairs)} pairs given, limit is {MAX_BATCH}")
+        materials = [str(m) for m, _ in pairs]
+        temps = np.array([finite_float(t, 'temperature') for _, t in pairs])
+        return materials, temps
+
+    if 'start' not in params or 'stop' not in params:
+        raise ValueError("expected pairs, or start and stop")
+    temps = sweep_temperatures(params['start'], params['stop'], params.get('step', 1))
+    return params.get('material', '800H'), temps
+
+@app.route('/youngs/batch', methods=['GET', 'POST'])
+@cache.cached(unless=wants_ndjson)
+def youngs_batch():
+    try:
+        materials, temps = parse_batch()
+    except (KeyError, TypeError, ValueError) as e:
+        return {"error": f"bad batch query: {e}"}, 400
+    try:
+        with span('lookup'):
+            res = engine.batch(materials, temps)
+    except LookupError as e:
+        return {"error": str(e)}, 404
+
+    # Raw little-endian float64 values, same order as the query
+    if request.args.get('format') == 'binary':
+        return Response(res.astype('<f8').tobytes(),
+                        mimetype='application/octet-stream',
+                        headers={'X-Count': str(len(res))})
+
+    if wants_ndjson():
+        if isinstance(materials, str):
+            materials = [materials] * len(res)
+        return ndjson_response(
+            {"material": m, "temperature": t, "Result": v}
+            for m, t, v in zip(materials, temps.tolist(), res.tolist()))
+
+    return {"material": materials, "temperature": temps.tolist(),
+            "Result": res.tolist()}
+
+@app.route('/youngs/sweep')
+def youngs_sweep():
+    # NDJSON stream of {"material", "temperature", "Result"} rows
+    material = request.args.get('material', '800H')
+    if 'start' not in request.args or 'stop' not in request.args:
+        return {"error": "bad sweep query: expected start and stop"}, 400
+    try:
+        start = finite_float(request.args['start'], 'start')
+        step = finite_float(request.args.get('step', 1), 'step')
+        count = sweep_count(start, request.args['stop'], step, MAX_STREAM)
+    except ValueError as e:
+        return {"error": f"bad sweep query: {e}"}, 400
+    # Fail before the stream starts rather than halfway through it; a
+    # material's valid range is one interval, so checking both ends covers it
+    try:
+        engine.interpolate(material, [start, start + step * (count - 1)])
+    except LookupError as e:
+        return {"error": str(e)}, 404
+
+    def rows():
+        for lo in range(0, count, STREAM_CHUNK):
+            temps = start + step * np.arange(lo, min(lo + STREAM_CHUNK, count))
+            with span('lookup'):
+                res = engine.interpolate(material, temps)
+            for t, v in zip(temps.tolist(), res.tolist()):
+                yield {"material": material, "temperature": t, "Result": v}
+
+    return ndjson_response(rows())
 
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for HBBdata used by the benchmarks.
+
+Gives deterministic values and a fixed, configurable cost per call
+(HBB_STUB_DELAY, in seconds) so runs on different machines measure the
+host rather than the data library.
+"""
+from . import elastic
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+DELAY = float(os.environ.get('HBB_STUB_DELAY', '0.0002'))
+
+# Smooth made-up curves (MPa against degrees C), not real alloy data
+MATERIALS = {
+    '800H': (196.5e3, -75.0, 0.01),
+    '316H': (195.0e3, -80.0, 0.012),
+}
+T_MIN = 20.0
+T_MAX = 1000.0
+
+
+def youngs(material, temperature):
+    if material not in MATERIALS:
+        raise KeyError(material)
+    if not T_MIN <= temperature <= T_MAX:
+        raise ValueError(f"{temperature} outside {T_MIN}-{T_MAX}")
+    # Busy-wait, since sleep granularity is too coarse at this scale
+    end = time.perf_counter() + DELAY
+    while time.perf_counter() < end:
+        pass
+    a, b, c = MATERIALS[material]
+    return (a + b * temperature + c * temperature ** 2, 'MPa')
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the host app.
+
+Starts application.py against the stand-in HBBdata in this directory and a
+scratch copy of data.db, once under the Flask dev server and once under
+gunicorn with several workers, then drives each scenario below at a fixed
+concurrency and records throughput and latency percentiles.
+
+    python bench/run.py --concurrency 16 --requests 2000 --out new.json
+    python bench/run.py --compare old.json --out new.json
+
+With --compare, any scenario whose p95 latency rose or whose throughput
+fell by more than --threshold is reported and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HOST_DIR = os.path.dirname(BENCH_DIR)
+
+SEED_DRINKS = 1000
+
+
+def scenarios(ids):
+    """name -> function of the request number giving (method, path, json)."""
+    some = ','.join(map(str, ids[:50]))
+    return {
+        'index': lambda i: ('GET', '/', None),
+        'youngs_hot': lambda i: ('GET', '/youngs/', None),
+        # Distinct temperatures, so neither cache layer can answer
+        'youngs_cold': lambda i: ('GET', f'/youngs/?temperature={20 + (i % 98000) / 100}', None),
+        'youngs_batch': lambda i: ('GET', '/youngs/batch?start=20&stop=1000&step=1', None),
+        'drink': lambda i: ('GET', f'/drinks/{ids[i % len(ids)]}', None),
+        'drinks_page': lambda i: ('GET', f'/drinks?limit=100&after={ids[i % len(ids)]}', None),
+        'drinks_bulk': lambda i: ('GET', f'/drinks/bulk?ids={some}', None),
+        # Names only need to be unique within one server's scratch database
+        'drink_write': lambda i: ('POST', '/drinks', {'name': f'bench-{time.perf_counter_ns()}-{i}'}),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(kind, port, workers):
+    if kind == 'dev':
+        return [sys.executable, '-c',
+                f"from application import app; app.run(port={port}, threaded=True)"]
+    return ['gunicorn', '-w', str(workers), '-k', 'gthread', '--threads', '4',
+            '-b', f'127.0.0.1:{port}', 'application:app']
+
+
+def start_server(kind, workers, scratch):
+    port = free_port()
+    db = os.path.join(scratch, f'{kind}.db')
+    shutil.copy(os.path.join(HOST_DIR, 'data.db'), db)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([BENCH_DIR, HOST_DIR, env.get('PYTHONPATH', '')])
+    env['DRINKS_DATABASE_URI'] = 'sqlite:///' + db
+    if kind == 'gunicorn':
+        # Workers need one cache between them for writes to invalidate it
+        env['RESPONSE_CACHE_PATH'] = os.path.join(scratch, 'cache.db')
+
+    proc = subprocess.Popen(server_command(kind, port, workers), cwd=HOST_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'{kind} server exited with status {proc.returncode}')
+        try:
+            requests.get(base + '/', timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'{kind} server did not come up on port {port}')
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def drive(base, make_request, total, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        mine = []
+        failed = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, body = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                res = session.request(method, base + path, json=body, timeout=30)
+                ok = res.status_code < 400
+            except requests.RequestException:
+                ok = False
+            mine.append(time.perf_counter() - t0)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda s: None if s is None else round(s * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'mean_ms': ms(statistics.fmean(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+def run_server(kind, args, scratch):
+    proc, base = start_server(kind, args.workers, scratch)
+    try:
+        res = requests.post(base + '/drinks/bulk', timeout=30, json={
+            'drinks': [{'name': f'seed-{i}', 'description': 'bench'} for i in range(SEED_DRINKS)]})
+        res.raise_for_status()
+        ids = res.json()['ids']
+
+        results = {}
+        for name, make_request in scenarios(ids).items():
+            if args.only and name not in args.only:
+                continue
+            drive(base, make_request, min(args.warmup, args.requests), args.concurrency)
+            results[name] = drive(base, make_request, args.requests, args.concurrency)
+            print(f"{kind:9} {name:13} {results[name]['throughput']:9.1f} req/s  "
+                  f"p50 {results[name]['p50_ms']:8.2f}  p95 {results[name]['p95_ms']:8.2f}  "
+                  f"p99 {results[name]['p99_ms']:8.2f} ms  errors {results[name]['errors']}")
+        return results
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def compare(old, new, threshold):
+    """Regressions between two result files, as human-readable lines."""
+    found = []
+    for kind, scenarios_new in new['results'].items():
+        for name, cur in scenarios_new.items():
+            prev = old.get('results', {}).get(kind, {}).get(name)
+            if prev is None:
+                continue
+            if prev['p95_ms'] and cur['p95_ms'] > prev['p95_ms'] * (1 + threshold):
+                found.append(f"{kind}/{name}: p95 {prev['p95_ms']} -> {cur['p95_ms']} ms")
+            if cur['throughput'] < prev['throughput'] * (1 - threshold):
+                found.append(f"{kind}/{name}: throughput {prev['throughput']} -> {cur['throughput']} req/s")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--servers', nargs='+', default=['dev', 'gunicorn'],
+                        choices=['dev', 'gunicorn'])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--only', nargs='+', help='scenario names to run')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to check against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'cpus': os.cpu_count(),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'workers': args.workers,
+            'stub_delay': os.environ.get('HBB_STUB_DELAY', '0.0002'),
+        },
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for kind in args.servers:
+            if kind == 'gunicorn' and shutil.which('gunicorn') is None:
+                print('gunicorn not installed, skipping multi-worker run')
+                continue
+            report['results'][kind] = run_server(kind, args, scratch)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for line in regressions:
+            print('REGRESSION', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
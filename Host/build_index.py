@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Compile material property tables into the index application.py maps.
+
+    python build_index.py
+    python build_index.py --materials 800H 316H --start 20 --stop 1000 --step 5
+
+Rerun whenever HBBdata or the grid changes; running workers keep the file
+they mapped and pick up the new one when restarted.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from properties import DEFAULT_GRID, DEFAULT_MATERIALS, PropertyEngine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the material property index.')
+    parser.add_argument('--out', default=os.environ.get(
+        'PROPERTY_INDEX', os.path.join(HERE, 'properties.idx')))
+    parser.add_argument('--materials', nargs='+', default=list(DEFAULT_MATERIALS))
+    parser.add_argument('--start', type=float, default=DEFAULT_GRID[0])
+    parser.add_argument('--stop', type=float, default=DEFAULT_GRID[-1])
+    parser.add_argument('--step', type=float, default=DEFAULT_GRID[1] - DEFAULT_GRID[0])
+    args = parser.parse_args(argv)
+
+    grid = np.arange(args.start, args.stop + args.step / 2, args.step)
+    engine = PropertyEngine(materials=args.materials, temperatures=grid)
+    missing = set(args.materials) - set(engine.materials())
+    if missing:
+        parser.error(f"HBBdata has no data on the grid for {', '.join(sorted(missing))}")
+
+    engine.write_index(args.out)
+    print(f"{len(engine.materials())} materials x {len(grid)} points -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
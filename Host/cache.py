@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache with strong ETags for the read-only routes.
+
+Cached bodies live in a store: MemoryStore keeps them in this process,
+DiskStore keeps them in a SQLite file so several workers share one cache
+(and see each other's invalidations). Entries carry tags, e.g. "drinks"
+or "drink:3", so a write can drop every response that depended on it.
+Stores are bounded both in entries and in total body bytes, and bodies
+over ResponseCache's max_body are never stored at all.
+
+Every invalidation bumps the store's generation. A response is only
+stored if the generation is still the one read before its view ran, so a
+write landing while a view is running can't leave the old body cached.
+"""
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, make_response, request
+
+# Largest body worth caching; bigger ones would push out many small entries
+MAX_BODY = 1 << 20
+
+
+class MemoryStore:
+    def __init__(self, maxsize=1024, maxbytes=64 << 20, ttl=300):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def _remove(self, key):
+        self._bytes -= len(self._entries.pop(key)[2])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:5]
+
+    def set(self, key, etag, body, mimetype, headers=(), tags=(), generation=None):
+        """Store an entry unless `generation` is given and has moved on."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, etag, body, mimetype,
+                                  tuple(headers), frozenset(tags))
+            self._bytes += len(body)
+            while len(self._entries) > self.maxsize or self._bytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+            return key in self._entries
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        with self._lock:
+            self._generation += 1
+            stale = [k for k, e in self._entries.items() if e[5] & tags]
+            for key in stale:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+
+class DiskStore:
+    """SQLite-backed store shared by every worker pointed at `path`."""
+
+    # Bumped whenever the tables change; an older cache file is emptied
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, maxsize=10000, maxbytes=256 << 20, ttl=300):
+        self.path = path
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._conn() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS entry')
+                conn.execute('DROP TABLE IF EXISTS tag')
+                conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+            conn.execute('CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, '
+                         'expires REAL, etag TEXT, body BLOB, mimetype TEXT, headers TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS tag (tag TEXT, key TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tag_tag ON tag (tag)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entry_expires ON entry (expires)')
+            conn.execute('CREATE TABLE IF NOT EXISTS generation (n INTEGER)')
+            if conn.execute('SELECT n FROM generation').fetchone() is None:
+                conn.execute('INSERT INTO generation VALUES (0)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        # Wall-clock time, since expiry has to mean the same across processes
+        row = self._conn().execute(
+            'SELECT etag, body, mimetype, headers FROM entry WHERE key = ? AND expires >= ?',
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return row[:3] + (tuple(map(tuple, json.loads(row[3]))),)
+
+    def generation(self):
+        return self._conn().execute('SELECT n FROM generation').fetchone()[0]
+
+    def set(self, key, etag, body, mimetype, headers=(), tags=(), generation=None):
+        """Store an entry unless `generation` is given and has moved on."""
+        with self._conn() as conn:
+            # Take the write lock first, so no invalidation can slip in
+            # between the generation check and the insert
+            conn.execute('BEGIN IMMEDIATE')
+            if generation is not None and generation != self.generation():
+                return False
+            conn.execute('INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, time.time() + self.ttl, etag, body, mimetype,
+                          json.dumps(list(headers))))
+            conn.execute('DELETE FROM tag WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO tag VALUES (?, ?)', [(t, key) for t in tags])
+            # Expired rows first, then the soonest to expire if still over size
+            conn.execute('DELETE FROM entry WHERE expires < ?', (time.time(),))
+            conn.execute('DELETE FROM entry WHERE key IN (SELECT key FROM entry '
+                         'ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+            conn.execute('DELETE FROM entry WHERE key IN (SELECT key FROM '
+                         '(SELECT key, SUM(length(body)) OVER (ORDER BY expires DESC) AS total '
+                         'FROM entry) WHERE total > ?)', (self.maxbytes,))
+            conn.execute('DELETE FROM tag WHERE key NOT IN (SELECT key FROM entry)')
+            return conn.execute('SELECT 1 FROM entry WHERE key = ?', (key,)).fetchone() is not None
+
+    def invalidate(self, *tags):
+        marks = ','.join('?' * len(tags))
+        with self._conn() as conn:
+            conn.execute('UPDATE generation SET n = n + 1')
+            conn.execute(f'DELETE FROM entry WHERE key IN '
+                         f'(SELECT key FROM tag WHERE tag IN ({marks}))', tags)
+            conn.execute(f'DELETE FROM tag WHERE tag IN ({marks})', tags)
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('UPDATE generation SET n = n + 1')
+            conn.execute('DELETE FROM entry')
+            conn.execute('DELETE FROM tag')
+
+
+def make_store(path=None, maxsize=None, maxbytes=None, ttl=300):
+    """DiskStore if a path is given (or RESPONSE_CACHE_PATH is set), else memory."""
+    path = path or os.environ.get('RESPONSE_CACHE_PATH')
+    if path:
+        return DiskStore(path, maxsize=maxsize or 10000,
+                         maxbytes=maxbytes or 256 << 20, ttl=ttl)
+    return MemoryStore(maxsize=maxsize or 1024, maxbytes=maxbytes or 64 << 20, ttl=ttl)
+
+
+class ResponseCache:
+    def __init__(self, store=None, max_body=MAX_BODY):
+        self.store = store if store is not None else make_store()
+        self.max_body = max_body
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, tags=None, unless=None):
+        """Cache a GET view's body and answer If-None-Match with 304.
+
+        `tags` is a function of the view's arguments returning the tags to
+        file the entry under; `unless` is checked per request to bypass the
+        cache (e.g. for streamed responses).
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or (unless and unless()):
+                    return view(*args, **kwargs)
+
+                key = request.full_path
+                entry = self.store.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    etag, body, mimetype, headers = entry
+                    res = Response(body, mimetype=mimetype, headers=list(headers))
+                else:
+                    self.misses += 1
+                    generation = self.store.generation()
+                    res = make_response(view(*args, **kwargs))
+                    if res.status_code != 200 or res.is_streamed:
+                        return res
+                    body = res.get_data()
+                    etag = hashlib.sha256(body).hexdigest()
+                    if len(body) <= self.max_body:
+                        entry_tags = tags(*args, **kwargs) if tags else ()
+                        self.store.set(key, etag, body, res.mimetype, self._extra_headers(res),
+                                       entry_tags, generation=generation)
+
+                res.set_etag(etag)
+                # Clients keep the body but must revalidate before reusing it
+                res.headers['Cache-Control'] = 'no-cache'
+                res.vary.add('Accept')
+                return res.make_conditional(request)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _extra_headers(res):
+        # Whatever the view set beyond the body's own type and length, so a
+        # hit answers with the same headers as the miss did
+        return tuple((name, value) for name, value in res.headers.items()
+                     if name.lower() not in ('content-type', 'content-length'))
+
+    def invalidate(self, *tags):
+        if tags:
+            self.store.invalidate(*tags)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Request timing, /metrics and opt-in profiling for the host.
+
+Every request is timed as a whole and in phases (lookup, db, serialize)
+with `span()`. The totals go into histograms served at /metrics in the
+Prometheus text format and back to the client in a Server-Timing header.
+
+Profiling is off unless HOST_PROFILING says otherwise:
+    header  profile requests that send "X-Profile: 1"
+    all     profile every request
+Each profiled request leaves a cProfile dump in PROFILE_DIR.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import cProfile
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds in milliseconds; the last bucket is everything above
+BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.sum += ms
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.phases = {}
+        self.statuses = {}
+        # name -> function returning {"hits": ..., "misses": ...}
+        self.cache_stats = {}
+
+    def observe_request(self, endpoint, status, ms):
+        with self._lock:
+            self.requests.setdefault(endpoint, Histogram()).observe(ms)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def observe_phase(self, phase, ms):
+        with self._lock:
+            self.phases.setdefault(phase, Histogram()).observe(ms)
+
+    def render(self):
+        """Everything collected so far in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'host_request_ms', 'endpoint', self.requests)
+            self._render_histograms(lines, 'host_phase_ms', 'phase', self.phases)
+            lines.append('# TYPE host_responses_total counter')
+            for status, n in sorted(self.statuses.items()):
+                lines.append(f'host_responses_total{{status="{status}"}} {n}')
+
+        for name, stats in self.cache_stats.items():
+            s = stats()
+            total = s['hits'] + s['misses']
+            lines.append(f'# TYPE host_{name}_hits_total counter')
+            lines.append(f'host_{name}_hits_total {s["hits"]}')
+            lines.append(f'# TYPE host_{name}_misses_total counter')
+            lines.append(f'host_{name}_misses_total {s["misses"]}')
+            lines.append(f'# TYPE host_{name}_hit_ratio gauge')
+            lines.append(f'host_{name}_hit_ratio {s["hits"] / total if total else 0.0:.4f}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, metric, label, histograms):
+        lines.append(f'# TYPE {metric} histogram')
+        for key, h in sorted(histograms.items()):
+            running = 0
+            for bound, n in zip(h.bounds, h.counts):
+                running += n
+                lines.append(f'{metric}_bucket{{{label}="{key}",le="{bound}"}} {running}')
+            lines.append(f'{metric}_bucket{{{label}="{key}",le="+Inf"}} {h.count}')
+            lines.append(f'{metric}_sum{{{label}="{key}"}} {h.sum:.3f}')
+            lines.append(f'{metric}_count{{{label}="{key}"}} {h.count}')
+
+
+metrics = Metrics()
+
+
+def _record_span(name, ms):
+    metrics.observe_phase(name, ms)
+    if has_request_context():
+        spans = g.setdefault('spans', {})
+        spans[name] = spans.get(name, 0.0) + ms
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as phase `name` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_span(name, (time.perf_counter() - start) * 1000)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    # Flask turns returned dicts into responses through here, so this is
+    # where serialization time goes
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _db_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _db_end(conn, cursor, statement, parameters, context, executemany):
+    _record_span('db', (time.perf_counter() - conn.info['query_start'].pop()) * 1000)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _db_error(context):
+    # A failed statement never reaches after_cursor_execute, so its start
+    # time has to come off here or it stays on the pooled connection
+    conn = context.connection
+    if conn is not None and conn.info.get('query_start'):
+        _record_span('db', (time.perf_counter() - conn.info['query_start'].pop()) * 1000)
+
+
+class Instrumentation:
+    def __init__(self, app=None):
+        self.profiling = os.environ.get('HOST_PROFILING', 'off')
+        self.profile_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.json = TimedJSONProvider(app)
+        self.profile_dir = app.config.setdefault(
+            'PROFILE_DIR', os.path.join(app.root_path, 'profiles'))
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.add_url_rule('/metrics', 'metrics', self._metrics)
+
+    def add_cache(self, name, stats):
+        metrics.cache_stats[name] = stats
+
+    def _wants_profile(self):
+        if self.profiling == 'all':
+            return True
+        return self.profiling == 'header' and request.headers.get('X-Profile') == '1'
+
+    def _before(self):
+        g.request_start = time.perf_counter()
+        if self.profiling != 'off' and self._wants_profile():
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir,
+                                f'{request.endpoint}-{time.time_ns()}.prof')
+            profiler.dump_stats(path)
+            response.headers['X-Profile-File'] = os.path.basename(path)
+
+        ms = (time.perf_counter() - g.get('request_start', time.perf_counter())) * 1000
+        metrics.observe_request(request.endpoint or 'unknown', response.status_code, ms)
+
+        timings = [f'{name};dur={dur:.3f}' for name, dur in g.get('spans', {}).items()]
+        timings.append(f'total;dur={ms:.3f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def _metrics(self):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Material property lookup engine for the host.
+
+Each configured material is sampled from HBBdata once, when the engine is
+built, and kept as a pair of NumPy arrays (temperatures, values); any other
+material is sampled the same way the first time it is looked up. Lookups
+interpolate linearly inside that grid and fall back to HBBdata itself for
+materials or temperatures the grid does not cover. Scalar lookups go
+through a bounded LRU cache keyed by (material, temperature).
+
+The tables can also be compiled ahead of time with build_index.py into a
+flat file of float64 arrays. PropertyEngine.from_index() maps that file
+instead of sampling, so every worker shares the same pages and HBBdata is
+only imported if a lookup falls outside the tables.
+"""
+from collections import OrderedDict
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+DEFAULT_MATERIALS = ('800H',)
+# Grid points reproduce HBBdata exactly, so keep the common query
+# temperatures (e.g. 500) on the grid.
+DEFAULT_GRID = np.arange(20.0, 1000.0 + 1.0, 10.0)
+
+# What HBBdata raises for an unknown material (KeyError) or a temperature
+# outside an alloy's range (ValueError); anything else is a real failure
+DATA_ERRORS = (LookupError, ValueError)
+
+# Index layout, all little-endian: header (magic, version, material count),
+# one directory entry per material (name, offset, point count), then for
+# each material its temperatures followed by its values as float64.
+INDEX_MAGIC = b'HBBIDX\0\0'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sII')
+INDEX_NAME_SIZE = 32
+INDEX_ENTRY = struct.Struct(f'<{INDEX_NAME_SIZE}sQQ')
+
+
+class PropertyEngine:
+    def __init__(self, source=None, materials=DEFAULT_MATERIALS,
+                 temperatures=DEFAULT_GRID, cache_size=4096):
+        self._source = source
+        self._grid = temperatures
+        self._tables = {}
+        # Materials HBBdata had no grid points for, so they aren't resampled
+        self._untabulated = set()
+        self._load_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        for material in materials:
+            self.load(material, temperatures)
+
+    @classmethod
+    def from_index(cls, path, source=None, cache_size=4096):
+        """Engine whose tables are views into the index file at `path`."""
+        engine = cls(source, materials=(), cache_size=cache_size)
+        with open(path, 'rb') as f:
+            # The mapping stays valid after the file is closed
+            engine._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = INDEX_HEADER.unpack_from(engine._map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} property index")
+        for i in range(count):
+            name, offset, n = INDEX_ENTRY.unpack_from(
+                engine._map, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+            temps = np.frombuffer(engine._map, dtype='<f8', count=n, offset=offset)
+            values = np.frombuffer(engine._map, dtype='<f8', count=n, offset=offset + 8 * n)
+            engine._tables[name.rstrip(b'\0').decode()] = (temps, values)
+        return engine
+
+    def write_index(self, path):
+        """Save the current tables as an index file for from_index()."""
+        names = self.materials()
+        offset = INDEX_HEADER.size + len(names) * INDEX_ENTRY.size
+        offset += -offset % 8
+        parts = [INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(names))]
+        data = []
+        for name in names:
+            encoded = name.encode()
+            if len(encoded) > INDEX_NAME_SIZE:
+                raise ValueError(f"material name {name!r} is too long for the index")
+            temps, values = self._tables[name]
+            parts.append(INDEX_ENTRY.pack(encoded, offset, len(temps)))
+            data.append(np.concatenate([temps, values]).astype('<f8').tobytes())
+            offset += 16 * len(temps)
+        header = b''.join(parts)
+        header += b'\0' * (-len(header) % 8)
+
+        # Written beside the target and swapped in, so workers that already
+        # mapped the old file keep a consistent copy
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            for chunk in data:
+                f.write(chunk)
+        os.replace(tmp, path)
+
+    def _resolve(self):
+        if self._source is None:
+            # Imported on first use, since an engine built from an index
+            # may never need it. Import errors propagate: a missing HBBdata
+            # is a broken install, not missing data.
+            import HBBdata
+            self._source = HBBdata.elastic.youngs
+        return self._source
+
+    def load(self, material, temperatures):
+        """Sample `material` over `temperatures` and keep it as a table.
+
+        Grid points HBBdata rejects (e.g. outside the alloy's valid range)
+        are dropped; if none are left the material stays untabulated.
+        """
+        source = self._resolve()
+        temps = []
+        values = []
+        for t in temperatures:
+            try:
+                res = source(material, float(t))
+            except DATA_ERRORS:
+                continue
+            temps.append(float(t))
+            values.append(float(res[0]))
+
+        if temps:
+            self._tables[material] = (np.asarray(temps), np.asarray(values))
+        else:
+            self._untabulated.add(material)
+
+    def _table(self, material):
+        # Sampled on first use, once, even with several threads asking
+        table = self._tables.get(material)
+        if table is None and material not in self._untabulated:
+            with self._load_lock:
+                if material not in self._tables and material not in self._untabulated:
+                    self.load(material, self._grid)
+            table = self._tables.get(material)
+        return table
+
+    def materials(self):
+        return sorted(self._tables)
+
+    def _direct(self, material, temperature):
+        source = self._resolve()
+        try:
+            res = source(material, float(temperature))
+        except DATA_ERRORS as e:
+            raise LookupError(f"no data for {material} at {temperature}: {e}")
+        return float(res[0])
+
+    def interpolate(self, material, temperatures):
+        """Vectorized lookup of `material` at every temperature given.
+
+        Points inside the tabulated range are interpolated in one pass;
+        anything outside it is resolved through HBBdata one by one.
+        """
+        temps = np.atleast_1d(np.asarray(temperatures, dtype=float))
+        table = self._table(material)
+        if table is None:
+            return np.array([self._direct(material, t) for t in temps])
+
+        grid, values = table
+        out = np.interp(temps, grid, values)
+        outside = (temps < grid[0]) | (temps > grid[-1])
+        if outside.any():
+            out[outside] = [self._direct(material, t) for t in temps[outside]]
+        return out
+
+    def batch(self, materials, temperatures):
+        """Look up many (material, temperature) pairs, one pass per material.
+
+        `materials` is either one name for every temperature or a sequence
+        parallel to `temperatures`.
+        """
+        temps = np.asarray(temperatures, dtype=float)
+        if isinstance(materials, str):
+            return self.interpolate(materials, temps)
+
+        materials = np.asarray(materials)
+        out = np.empty(len(temps))
+        for material in np.unique(materials):
+            mask = materials == material
+            out[mask] = self.interpolate(str(material), temps[mask])
+        return out
+
+    def lookup(self, material, temperature):
+        key = (material, float(temperature))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        value = float(self.interpolate(material, [key[1]])[0])
+
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._cache), "maxsize": self._cache_size}
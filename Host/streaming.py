@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Newline-delimited JSON streaming for large result sets.
+
+Routes hand over a generator of rows and the rows are encoded and sent as
+they are produced, so neither side has to hold the whole result.
+"""
+import json
+
+from flask import Response, request, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+
+# Rows joined into each chunk written to the socket
+CHUNK_ROWS = 1000
+
+
+def wants_ndjson():
+    """True if the client asked for NDJSON via ?format= or Accept."""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return NDJSON in request.accept_mimetypes.values()
+
+
+def ndjson_response(rows, chunk_rows=CHUNK_ROWS):
+    """Stream `rows` (an iterable of dicts) as NDJSON with chunked transfer."""
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def generate():
+        buf = []
+        for row in rows:
+            buf.append(encode(row))
+            if len(buf) >= chunk_rows:
+                buf.append('')
+                yield '\n'.join(buf)
+                buf = []
+        if buf:
+            buf.append('')
+            yield '\n'.join(buf)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = os.path.join(ROOT, 'Host')
+
+# The host runs against the benchmark stand-in for HBBdata and a scratch
+# copy of data.db, with no prebuilt property index
+sys.path[:0] = [os.path.join(ROOT, 'Client'), HOST, os.path.join(HOST, 'bench')]
+
+_scratch = tempfile.mkdtemp()
+shutil.copy(os.path.join(HOST, 'data.db'), os.path.join(_scratch, 'data.db'))
+os.environ['DRINKS_DATABASE_URI'] = 'sqlite:///' + os.path.join(_scratch, 'data.db')
+os.environ['PROPERTY_INDEX'] = os.path.join(_scratch, 'properties.idx')
+os.environ.pop('RESPONSE_CACHE_PATH', None)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from application import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize('query', [
+    'start=20&stop=inf',
+    'start=-inf&stop=40',
+    'start=nan&stop=40',
+    'start=20&stop=40&step=1e-320',
+    'start=20&stop=40&step=0',
+    'start=40&stop=20',
+    'start=abc&stop=40',
+    'start=20',
+])
+@pytest.mark.parametrize('endpoint', ['/youngs/sweep', '/youngs/batch'])
+def test_bad_sweep_parameters(client, endpoint, query):
+    res = client.get(f'{endpoint}?{query}')
+    assert res.status_code == 400
+    assert 'error' in res.json
+
+
+def test_sweep_streams_rows(client):
+    res = client.get('/youngs/sweep?start=20&stop=40&step=10')
+    assert res.status_code == 200
+    assert res.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert [row['temperature'] for row in rows] == [20.0, 30.0, 40.0]
+
+
+def test_sweep_past_valid_range_fails_up_front(client):
+    res = client.get('/youngs/sweep?start=980&stop=1020&step=10')
+    assert res.status_code == 404
+    assert 'error' in res.json
+
+
+@pytest.mark.parametrize('method, body', [
+    ('POST', {'drinks': [{'nam': 'z'}]}),
+    ('POST', {'drinks': [{'name': 'z', 'description': 5}]}),
+    ('POST', {'drinks': 'z'}),
+    ('POST', [{'name': 'z'}]),
+    ('DELETE', {'ids': ['a']}),
+    ('DELETE', {'ids': 3}),
+    ('DELETE', [1, 2]),
+])
+def test_bad_bulk_bodies(client, method, body):
+    res = client.open('/drinks/bulk', method=method, json=body)
+    assert res.status_code == 400
+    assert 'error' in res.json
+
+
+def test_bulk_insert_and_delete(client):
+    res = client.post('/drinks/bulk', json={'drinks': [{'name': 'bulk-a'}, {'name': 'bulk-b'}]})
+    ids = res.json['ids']
+    assert len(ids) == 2
+    assert client.delete('/drinks/bulk', json={'ids': ids}).json == {'deleted': 2}
+
+
+@pytest.mark.parametrize('query', ['temperature=abc', 'temperature=nan', 'temperature=inf'])
+def test_bad_temperature(client, query):
+    assert client.get(f'/youngs/?{query}').status_code == 400
+
+
+def test_cache_hit_keeps_view_headers(client):
+    url = '/youngs/batch?start=20&stop=40&step=10&format=binary'
+    miss, hit = client.get(url), client.get(url)
+    assert miss.headers['X-Count'] == hit.headers['X-Count'] == '3'
+    assert hit.data == miss.data
+
+
+@pytest.mark.parametrize('method, url, body, status', [
+    ('GET', f'/drinks/{2 ** 64}', None, 404),
+    ('DELETE', f'/drinks/{2 ** 64}', None, 404),
+    ('GET', f'/drinks?after={2 ** 64}', None, 400),
+    ('GET', f'/drinks/bulk?ids=1,{2 ** 64}', None, 400),
+    ('DELETE', '/drinks/bulk', {'ids': [2 ** 64]}, 400),
+])
+def test_ids_past_64_bits(client, method, url, body, status):
+    assert client.open(url, method=method, json=body).status_code == status
+
+
+def test_youngs_returns_engine_value(client):
+    from application import engine
+
+    res = client.get('/youngs/?material=316H&temperature=412.5')
+    assert res.json == {'Result': engine.lookup('316H', 412.5)}
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from application import app
+from cache import DiskStore, MemoryStore
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore(maxbytes=25)
+    return DiskStore(str(tmp_path / 'cache.db'), maxbytes=25)
+
+
+def test_if_none_match_gets_304(client):
+    first = client.get('/youngs/?temperature=500')
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get('/youngs/?temperature=500',
+                       headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def last_page(client):
+    return client.get('/drinks?limit=1000&after=0').json['drinks']
+
+
+def test_writes_invalidate_drinks(client):
+    before = last_page(client)
+    id = client.post('/drinks', json={'name': 'cache-test'}).json['id']
+    assert [d['id'] for d in last_page(client)] == [d['id'] for d in before] + [id]
+
+    assert client.get(f'/drinks/{id}').json['name'] == 'cache-test'
+    assert client.delete(f'/drinks/{id}').status_code == 200
+    assert client.get(f'/drinks/{id}').status_code == 404
+    assert last_page(client) == before
+
+
+def test_bulk_delete_invalidates_drink(client):
+    id = client.post('/drinks', json={'name': 'cache-bulk'}).json['id']
+    assert client.get(f'/drinks/{id}').status_code == 200
+    client.delete('/drinks/bulk', json={'ids': [id]})
+    assert client.get(f'/drinks/{id}').status_code == 404
+
+
+def test_store_round_trip(store):
+    assert store.set('k', 'etag', b'body', 'text/plain', [('X-Count', '3')], ['t'])
+    assert store.get('k') == ('etag', b'body', 'text/plain', (('X-Count', '3'),))
+    store.invalidate('t')
+    assert store.get('k') is None
+
+
+def test_store_byte_budget(store):
+    for key in 'abc':
+        store.set(key, 'etag', b'x' * 10, 'text/plain')
+    # 30 bytes against a budget of 25, so the oldest went
+    assert store.get('a') is None
+    assert store.get('b') is not None and store.get('c') is not None
+
+
+def test_store_skips_set_after_invalidation(store):
+    generation = store.generation()
+    store.invalidate('drinks')
+    assert not store.set('k', 'etag', b'old', 'text/plain', generation=generation)
+    assert store.get('k') is None
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from application import app, instrumentation
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_metrics(client):
+    client.get('/youngs/?temperature=510')
+    body = client.get('/metrics').data.decode()
+    assert 'host_request_ms_count{endpoint="youngs"}' in body
+    assert 'host_phase_ms_bucket{phase="lookup",le="+Inf"}' in body
+    assert 'host_property_cache_hits_total' in body
+    assert 'host_response_cache_hit_ratio' in body
+
+
+def test_server_timing(client):
+    res = client.get('/youngs/?temperature=520')
+    timings = dict(part.split(';') for part in res.headers['Server-Timing'].split(', '))
+    assert {'lookup', 'serialize', 'total'} <= set(timings)
+
+
+def test_profile_dump(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'profiling', 'header')
+    monkeypatch.setattr(instrumentation, 'profile_dir', str(tmp_path))
+    assert 'X-Profile-File' not in client.get('/youngs/?temperature=530').headers
+    res = client.get('/youngs/?temperature=530', headers={'X-Profile': '1'})
+    assert os.listdir(tmp_path) == [res.headers['X-Profile-File']]
+
+
+def test_failed_statement_leaves_no_start_time():
+    engine = create_engine('sqlite://')
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text('SELECT * FROM missing'))
+        assert not conn.info.get('query_start')
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+import jsonpipe
+
+FLOATS = {'values': [2.5, -0.125, 1e16, 2.5e-7, -3.25E+10, 0, 17, 123456.789,
+                     {'x': 1.5, 'y': [6.02e23, -1]}, 'Sāo Paulo', True, None]}
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 33))
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_array_floats_across_chunks(chunk_size, indent):
+    text = json.dumps(FLOATS, indent=indent)
+    expected = json.load(io.StringIO(text))['values']
+    assert list(jsonpipe.iter_array(io.StringIO(text), 'values', chunk_size)) == expected
+
+
+@pytest.mark.parametrize('pad', range(0, 12))
+def test_number_at_default_chunk_boundary(pad):
+    text = '[' + ' ' * (jsonpipe.CHUNK_SIZE - 3 - pad) + '2.5e-3, 1.25]'
+    assert list(jsonpipe.iter_array(io.StringIO(text))) == [2.5e-3, 1.25]
+
+
+@pytest.mark.parametrize('indent', [None, 2, 4])
+def test_write_array_matches_json_dump(indent):
+    records = FLOATS['values']
+    out = io.StringIO()
+    jsonpipe.write_array(iter(records), out, key='values', indent=indent, sort_keys=True)
+    assert out.getvalue() == json.dumps({'values': records}, indent=indent, sort_keys=True)
+
+
+def test_write_array_fast_is_equivalent():
+    records = FLOATS['values']
+    out = io.StringIO()
+    jsonpipe.write_array(iter(records), out, key='values', indent=2, fast=True)
+    assert json.loads(out.getvalue()) == {'values': records}
+
+
+def test_drop_and_project():
+    records = [{'name': 'a', 'phone': '1', 'age': 3}]
+    stages = [jsonpipe.drop('phone'), jsonpipe.project('name', 'phone')]
+    assert list(jsonpipe.pipeline(iter(records), *stages)) == [{'name': 'a'}]
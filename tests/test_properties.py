@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from properties import PropertyEngine
+
+
+def test_missing_hbbdata_is_not_swallowed(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'HBBdata', None)
+    with pytest.raises(ImportError):
+        PropertyEngine()
+
+
+def test_source_failures_are_not_swallowed():
+    def broken(material, temperature):
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        PropertyEngine(source=broken)
+
+
+
+def counting_source():
+    import HBBdata
+
+    calls = []
+
+    def source(material, temperature):
+        calls.append((material, temperature))
+        return HBBdata.elastic.youngs(material, temperature)
+    return source, calls
+
+
+def test_other_materials_are_tabulated_on_first_use():
+    source, calls = counting_source()
+    engine = PropertyEngine(source=source, materials=())
+    first = engine.interpolate('316H', [25.0, 505.0, 995.0])
+    assert '316H' in engine.materials()
+    calls.clear()
+    assert list(engine.interpolate('316H', [25.0, 505.0, 995.0])) == list(first)
+    assert calls == []
+
+
+def test_index_matches_sampled_engine(tmp_path, monkeypatch):
+    sampled = PropertyEngine(materials=('800H', '316H'))
+    path = str(tmp_path / 'properties.idx')
+    sampled.write_index(path)
+
+    # In-grid lookups must come from the index alone
+    monkeypatch.setitem(sys.modules, 'HBBdata', None)
+    indexed = PropertyEngine.from_index(path)
+    assert indexed.materials() == ['316H', '800H']
+    temps = [20.0, 25.0, 333.3, 500.0, 999.9, 1000.0]
+    for material in ('800H', '316H'):
+        assert list(indexed.interpolate(material, temps)) == list(sampled.interpolate(material, temps))
+        assert indexed.lookup(material, 505) == sampled.lookup(material, 505)
+
+
+def test_lookup_counts_hits_and_misses():
+    engine = PropertyEngine()
+    engine.lookup('800H', 500)
+    engine.lookup('800H', 500.0)
+    engine.lookup('800H', 510)
+    assert engine.stats() == {'hits': 1, 'misses': 2, 'size': 2, 'maxsize': 4096}
+
+
+def test_lookup_evicts_least_recently_used():
+    engine = PropertyEngine(cache_size=2)
+    engine.lookup('800H', 100)
+    engine.lookup('800H', 200)
+    engine.lookup('800H', 100)
+    engine.lookup('800H', 300)
+    assert engine.stats()['size'] == 2
+    engine.lookup('800H', 100)
+    assert engine.stats()['hits'] == 2
+    engine.lookup('800H', 200)
+    assert engine.stats()['misses'] == 4